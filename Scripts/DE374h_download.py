@@ -12,17 +12,268 @@ Usage:
 # Standard library imports
 import os
 import sys
+import logging
 import argparse
 import datetime
+import shutil
 import subprocess
+from pathlib import Path
+from typing import List, Tuple
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Local imports
-from c_directories import c_directories
-from c_api_request import c_api_request
+from c_directories import c_directories, get_directories
+from c_api_request import c_api_request, commit_file, WIND_100M_PARAMS
 
 # Third-party imports
 import eccodes as ecc
 
+logger = logging.getLogger(__name__)
+
+# Maximum number of download jobs running at the same time
+# (Polytope requests are further limited by c_api_request)
+MAX_WORKERS = 5
+
+# Buffer size used when writing GRIB files (GRIB messages are several MB)
+IO_BUFFER_SIZE = 1 << 20
+
+# grib_filter rules used to rewrite the precipitation steps natively
+PRECIPITATION_RULES = Path(__file__).with_name("edt_precipitation_steps.rules")
+
+# Files smaller than this are treated as incomplete and downloaded again
+MIN_BYTES = 1 << 20
+
+
+def is_downloaded(grib_path: Path, check_messages: bool = False) -> bool:
+    """
+    Check whether a GRIB file left by a previous run can be reused.
+    
+    Args:
+        grib_path: Path to the GRIB file
+        check_messages: Also check that ecCodes finds GRIB messages in it
+        
+    Returns:
+        bool: True if the file does not need to be downloaded again
+    """
+    if not os.path.exists(grib_path) or os.path.getsize(grib_path) < MIN_BYTES:
+        return False
+    if check_messages:
+        with open(grib_path, 'rb') as f:
+            return ecc.codes_count_in_file(f) > 0
+    return True
+
+
+def fix_precipitation_steps(tmp_grib_path: Path) -> None:
+    """
+    Rewrite the step metadata of an Extremes-DT precipitation GRIB file.
+
+    Polytope returns hourly accumulation windows (e.g. 4-5); they are
+    changed in place so that every accumulation starts from step 0.
+    The ecCodes grib_filter tool is used when available, otherwise
+    the messages are rewritten in Python.
+
+    Args:
+        tmp_grib_path: Path to the precipitation GRIB file to modify
+    """
+    rewrite_path = f"{tmp_grib_path}.tmp"
+    if shutil.which("grib_filter"):
+        # Native rewrite (eccodes module loaded on Leonardo)
+        subprocess.run(
+            ["grib_filter", "-o", rewrite_path, str(PRECIPITATION_RULES), str(tmp_grib_path)],
+            check=True
+        )
+    else:
+        rewrite_precipitation_steps(tmp_grib_path, rewrite_path)
+    
+    # Replace the original file with the modified one
+    os.replace(rewrite_path, tmp_grib_path)
+    logger.info("Modifiche step completate per il file %s", tmp_grib_path)
+
+
+def rewrite_precipitation_steps(tmp_grib_path: Path, rewrite_path: str) -> None:
+    """
+    Python fallback of the precipitation step rewrite.
+
+    Same changes as edt_precipitation_steps.rules: the modified messages
+    are streamed to a new file, one at a time.
+
+    Args:
+        tmp_grib_path: Path to the precipitation GRIB file to read
+        rewrite_path: Path of the modified GRIB file to write
+    """
+    # All the messages share the same template: check the step keys once
+    has_end_step = None
+    has_start_step = None
+    with open(tmp_grib_path, 'rb') as fin, open(rewrite_path, 'wb', buffering=IO_BUFFER_SIZE) as fout:
+        while True:
+            # Read next GRIB message from file
+            msg = ecc.codes_grib_new_from_file(fin)
+            if msg is None:
+                break
+            if has_end_step is None:
+                has_end_step = ecc.codes_is_defined(msg, 'endStep')
+                has_start_step = ecc.codes_is_defined(msg, 'startStep')
+            
+            # Extract current forecast step information
+            if has_end_step:
+                step_end = ecc.codes_get_long(msg, 'endStep')
+            else:
+                step_end = ecc.codes_get_long(msg, 'forecastTime')
+            
+            # Modify step to start from 0 (for accumulation)
+            ecc.codes_set_long(msg, 'forecastTime', 0)
+            if has_start_step:
+                ecc.codes_set_long(msg, 'startStep', 0)
+                ecc.codes_set_long(msg, 'endStep', step_end)
+            
+            # Write modified message and free it before reading the next one
+            ecc.codes_write(msg, fout)
+            ecc.codes_release(msg)
+
+
+def download_edt_group(
+    nwp_download: c_api_request,
+    dirs: c_directories,
+    ds: str,
+    group: str,
+    levtype: str,
+    params: List[str],
+) -> Tuple[List[Path], List[str]]:
+    """
+    Download a group of Extremes-DT parameters with a single Polytope request.
+
+    Extremes-DT is not always homogeneously available, so if the batched
+    request fails each parameter of the group is retried on its own.
+    The precipitation group is post-processed as soon as it is available.
+
+    Args:
+        nwp_download: API request handler
+        dirs: Directory structure of the current run
+        ds: Date in YYYYMMDD format
+        group: Group name, used to name the temporary file
+        levtype: Level type shared by the group ('sfc' or 'hl')
+        params: ECMWF parameter codes of the group
+
+    Returns:
+        tuple: Paths of the temporary files actually downloaded, and the
+            parameters of the group that could not be downloaded
+    """
+    tmp_grib_path = dirs.get_sfc_temp_path(ds, group)
+    # A previous run already fell back to per-parameter files: complete those
+    resume_per_param = len(params) > 1 and any(
+        os.path.exists(dirs.get_sfc_temp_path(ds, p)) for p in params
+    )
+    if is_downloaded(tmp_grib_path, check_messages=True):
+        logger.info("Already downloaded %s", tmp_grib_path)
+        downloaded = True
+    elif resume_per_param:
+        downloaded = False
+    else:
+        request = nwp_download.polytope_get_batched_request(ds, params, levtype)
+        downloaded = nwp_download.perform_politope_request(request, tmp_grib_path)
+    
+    if downloaded:
+        # Special handling for precipitation (param 228)
+        # Need to modify GRIB step metadata to start from 0; done here so
+        # that the rewrites of different days run on the worker threads
+        if group == "228":
+            fix_precipitation_steps(tmp_grib_path)
+        return [tmp_grib_path], []
+    if len(params) == 1:
+        return [], params
+
+    # Fall back to one request per parameter
+    tmp_grib_paths = []
+    missing_params = []
+    for p in params:
+        tmp_grib_path = dirs.get_sfc_temp_path(ds, p)
+        if is_downloaded(tmp_grib_path, check_messages=True):
+            tmp_grib_paths.append(tmp_grib_path)
+            continue
+        request = nwp_download.polytope_get_instant_variables_request(ds, p)
+        if nwp_download.perform_politope_request(request, tmp_grib_path):
+            tmp_grib_paths.append(tmp_grib_path)
+        else:
+            missing_params.append(p)
+    return tmp_grib_paths, missing_params
+
+
+def merge_edt_files(edt_file_paths: List[Path], final_file: Path) -> None:
+    """
+    Merge all temporary Extremes-DT parameter files of a day.
+
+    Args:
+        edt_file_paths: Temporary files downloaded for the day
+        final_file: Path of the daily GRIB file to create
+    """
+    if not edt_file_paths:
+        return
+    
+    # Build the daily file next to its final path, renamed only once complete
+    part_path = f"{final_file}.part"
+    if len(edt_file_paths) == 1:
+        # Nothing to concatenate: just move the file in place
+        shutil.move(edt_file_paths[0], part_path)
+        commit_file(part_path, final_file)
+    else:
+        # GRIB messages are self-delimited: concatenate the raw bytes
+        with open(part_path, 'wb', buffering=IO_BUFFER_SIZE) as out:
+            for file_path in edt_file_paths:
+                with open(file_path, 'rb', buffering=IO_BUFFER_SIZE) as f:
+                    shutil.copyfileobj(f, out, length=IO_BUFFER_SIZE)
+        commit_file(part_path, final_file)
+        
+        # Remove temporary files to save disk space
+        for file_path in edt_file_paths:
+            os.remove(file_path)
+
+
+def finish_edt_day(
+    dirs: c_directories,
+    ds: str,
+    edt_file_paths: List[Path],
+    missing_params: List[str],
+) -> None:
+    """
+    Save the daily Extremes-DT file once all parameter groups are processed.
+
+    A day with missing parameters is retried once: the first time its
+    temporary files are kept for the next run, which requests only the
+    missing parameters again. If they are still unavailable, the day is
+    saved with the parameters downloaded so far, and the missing ones are
+    listed in a sidecar file next to the daily file.
+
+    Args:
+        dirs: Directory structure of the current run
+        ds: Date in YYYYMMDD format
+        edt_file_paths: Temporary files downloaded for the day
+        missing_params: Parameters that could not be downloaded
+    """
+    missing_path = dirs.get_missing_params_path(ds)
+    if not missing_params:
+        merge_edt_files(edt_file_paths, dirs.get_final_grib_path(ds))
+        if missing_path.exists():
+            os.remove(missing_path)
+        return
+
+    retried = missing_path.exists()
+    missing_path.parent.mkdir(parents=True, exist_ok=True)
+    missing_path.write_text("\n".join(missing_params) + "\n")
+    if not retried:
+        logger.warning(
+            "Missing parameters for %s: %s, retrying them in the next run",
+            ds, ", ".join(missing_params),
+        )
+        return
+
+    logger.warning(
+        "Parameters still missing for %s: %s, saving the available ones (see %s)",
+        ds, ", ".join(missing_params), missing_path,
+    )
+    merge_edt_files(edt_file_paths, dirs.get_final_grib_path(ds))
+
+
 def main(
     nwp: str,
     run_where: str,
@@ -31,6 +282,9 @@ def main(
 ):
     """
     Main function to download weather forecast data.
+
+    Requests are independent and dominated by remote processing and
+    network I/O, so they are run concurrently on a thread pool.
     
     Args:
         nwp: NWP model type ('ifs' or 'edt')
@@ -39,114 +293,98 @@ def main(
         date_f: End date in YYYYMMDD format
     """
     # Initialize directory structure based on NWP model and environment
-    dirs = c_directories(nwp, run_where)
+    dirs = get_directories(nwp, run_where)
     
     # Initialize API request handler with date range and geographic bounds
     # Area: North/West/South/East = 70.5/-23.5/29.5/62.5 (Europe region)
     nwp_download = c_api_request(date_i, date_f, "70.5/-23.5/29.5/62.5")
     
-    # Convert string dates to datetime objects for iteration
+    # Convert string dates to datetime objects
     start = datetime.datetime.strptime(date_i, "%Y%m%d")
     end = datetime.datetime.strptime(date_f, "%Y%m%d")
-    # Initialize date iterator
-    d = start
+    # Build the list of days to process, in YYYYMMDD format for file naming
+    dates = [
+        (start + datetime.timedelta(days=i)).strftime("%Y%m%d")
+        for i in range((end - start).days + 1)
+    ]
     
     # Process IFS operational data via MARS
     if nwp == "ifs":
-        while d <= end:
-            # Convert datetime to string format for file naming
-            ds = d.strftime("%Y%m%d")
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = []
+            for ds in dates:
+                # Skip days already downloaded by a previous run
+                final_file = dirs.get_final_grib_path(ds)
+                if is_downloaded(final_file):
+                    logger.info("Already downloaded %s", final_file)
+                    continue
 
-            # Create MARS request for IFS data
-            request = nwp_download.mars_get_ifs(ds)
-            final_file = dirs.get_final_grib_path(ds)
-            
-            # Execute MARS request and download to final file
-            nwp_download.perform_mars_request(request, final_file)
+                # Create MARS request for IFS data
+                request = nwp_download.mars_get_ifs(ds)
+                
+                # Execute MARS request and download to final file
+                futures.append(
+                    executor.submit(nwp_download.perform_mars_request, request, final_file)
+                )
 
-            # Move to next day
-            d += datetime.timedelta(days=1)
+            # Wait for all days to be downloaded
+            for future in as_completed(futures):
+                future.result()
     # Process Extremes-DT data via Polytope
     elif nwp == "edt":
-        while d <= end:
-            # Parameter list changes based on date due to system updates
-            if d < datetime.datetime(2025, 2, 5):
-                # Old parameter set: includes 228246, 228247 (100m wind components)
-                params = ["228", "167", "168", "165", "166", "228246", "228247"]
-            else:
-                # New parameter set: includes 131, 132 (u/v wind components)
-                params = ["228", "167", "168", "165", "166", "131", "132"]
-
-            ds = d.strftime("%Y%m%d")
-            final_file = dirs.get_final_grib_path(ds)
-            # Process each weather parameter separately
-            for p in params:
-                # Create Polytope request for specific parameter
-                request = nwp_download.polytope_get_instant_variables_request(ds, p)
-                tmp_grib_path = dirs.get_sfc_temp_path(ds, p)
-                
-                # Download parameter data to temporary file
-                result = nwp_download.perform_politope_request(request, tmp_grib_path)
-                
-                if result:
-                    # Special handling for precipitation (param 228)
-                    # Need to modify GRIB step metadata to start from 0
-                    if p == "228":                    
-                        # Process and modify the GRIB messages for precipitation
-                        # Precipitation accumulation needs step adjustment
-                        modified_messages = []
-                        with open(tmp_grib_path, 'rb') as f:
-                            while True:
-                                # Read next GRIB message from file
-                                msg = ecc.codes_grib_new_from_file(f)
-                                if msg is None:
-                                    break
-                                
-                                # Extract current forecast step information
-                                step_start = ecc.codes_get(msg, 'forecastTime')
-                                step_end = ecc.codes_get(msg, 'endStep') if ecc.codes_is_defined(msg, 'endStep') else step_start
-                                
-                                # Modify step to start from 0 (for accumulation)
-                                ecc.codes_set(msg, 'forecastTime', 0)
-                                if ecc.codes_is_defined(msg, 'startStep'):
-                                    ecc.codes_set(msg, 'startStep', 0)
-                                    ecc.codes_set(msg, 'endStep', step_end)
-                                
-                                # Store modified message for writing back
-                                modified_messages.append(ecc.codes_get_message(msg))
-                                ecc.codes_release(msg)
-                        
-                        # Write the modified messages back to the file
-                        with open(tmp_grib_path, 'wb') as f:
-                            for msg_bytes in modified_messages:
-                                f.write(msg_bytes)
-                        print("Modifiche step completate per il file", tmp_grib_path)               
-
-            # Find all EDT temporary files for current date
-            edt_files = [
-                f for f in os.listdir(dirs.nwp_temp)
-                if "edt" in f and ds in f
-            ]
-
-            # Merge all parameter files into single daily file
-            if edt_files:
+        # Parameter groups still being downloaded for each day
+        pending = defaultdict(set)
+        # Temporary files downloaded so far for each day
+        edt_file_paths = defaultdict(list)
+        # Parameters that could not be downloaded for each day
+        missing_params = defaultdict(list)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {}
+            for ds in dates:
+                # Skip days already downloaded by a previous run
                 final_file = dirs.get_final_grib_path(ds)
-                edt_file_paths = [
-                    os.path.join(dirs.nwp_temp, f) for f in edt_files
-                ]
-                
-                # Use grib_copy to concatenate all parameter files
-                subprocess.run(
-                    ["grib_copy"] + edt_file_paths + [final_file],
-                    check=True
-                )
-                
-                # Remove temporary files to save disk space
-                for file_path in edt_file_paths:
-                    os.remove(file_path)
+                if is_downloaded(final_file):
+                    logger.info("Already downloaded %s", final_file)
+                    continue
+
+                # Parameter list changes based on date due to system updates
+                if ds < "20250205":  # YYYYMMDD strings compare chronologically
+                    # Old parameter set: includes 228246, 228247 (100m wind components)
+                    params = ["228", "167", "168", "165", "166", "228246", "228247"]
+                else:
+                    # New parameter set: includes 131, 132 (u/v wind components)
+                    params = ["228", "167", "168", "165", "166", "131", "132"]
 
-            # Move to next day
-            d += datetime.timedelta(days=1)
+                # Group parameters sharing the same request configuration:
+                # precipitation has its own accumulation steps and the 100m
+                # winds are on height levels
+                groups = {
+                    "228": ("sfc", ["228"]),
+                    "sfc": ("sfc", [p for p in params if p != "228" and p not in WIND_100M_PARAMS]),
+                    "hl": ("hl", [p for p in params if p in WIND_100M_PARAMS]),
+                }
+                # Download each group of parameters with a single request
+                for group, (levtype, group_params) in groups.items():
+                    future = executor.submit(
+                        download_edt_group,
+                        nwp_download, dirs, ds, group, levtype, group_params,
+                    )
+                    futures[future] = (ds, group)
+                    pending[ds].add(group)
+
+            for future in as_completed(futures):
+                ds, group = futures[future]
+                tmp_grib_paths, group_missing = future.result()
+
+                edt_file_paths[ds].extend(tmp_grib_paths)
+                missing_params[ds].extend(group_missing)
+                pending[ds].discard(group)
+                if not pending[ds]:
+                    finish_edt_day(
+                        dirs, ds,
+                        sorted(edt_file_paths.pop(ds)),
+                        sorted(missing_params.pop(ds)),
+                    )
 
 
 if __name__ == "__main__":
@@ -187,6 +425,13 @@ if __name__ == "__main__":
     # Parse command line arguments
     args = parser.parse_args()
 
+    # Timestamped progress messages on stdout (thread-safe)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(message)s",
+        stream=sys.stdout,
+    )
+
     # Validate date format before proceeding
     try:
         datetime.datetime.strptime(args.date_i, "%Y%m%d")
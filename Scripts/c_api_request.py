@@ -9,11 +9,47 @@ Supports downloading various meteorological parameters with flexible date ranges
 and geographic bounding boxes.
 """
 
-import datetime
-from typing import Dict, Any, Optional
+import os
+import logging
+import threading
+from typing import Dict, Any, List
 from pathlib import Path
 
-import earthkit.data as ek
+# Extremes-DT wind parameters at 100m height (levtype 'hl')
+WIND_100M_PARAMS = frozenset(("131", "132", "228246", "228247"))
+
+# Maximum number of Polytope requests running at the same time
+# (Polytope allows at most 5 concurrent operations per user)
+POLYTOPE_MAX_REQUESTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def commit_file(part_path: str, output_file_path: Path) -> None:
+    """
+    Atomically move a fully written file to its final path.
+    
+    The data is flushed to disk before the rename, so the final path
+    either does not exist or holds a complete file, even after a crash.
+    
+    Args:
+        part_path: Path of the completely written temporary file
+        output_file_path: Final path of the file
+    """
+    with open(part_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(part_path, output_file_path)
+
+
+def remove_partial_file(part_path: str) -> None:
+    """
+    Remove the temporary file left by a failed download, if any.
+    
+    Args:
+        part_path: Path of the temporary file
+    """
+    if os.path.exists(part_path):
+        os.remove(part_path)
 
 
 class c_api_request:
@@ -37,7 +73,87 @@ class c_api_request:
         self.date_i = date_i
         self.date_f = date_f
         self.polytope_address = "polytope.lumi.apps.dte.destination-earth.eu"
+        self.polytope_collection = "ecmwf-destination-earth"
         self.area_bbox = area_bbox
+        
+        # MARS/Polytope clients, created on first use and then reused for
+        # every request (one per thread, as requests may run concurrently)
+        self._clients = threading.local()
+        # Keep concurrent Polytope requests within the server quota,
+        # whatever the number of threads calling this handler
+        self._polytope_slots = threading.BoundedSemaphore(POLYTOPE_MAX_REQUESTS)
+        
+        # Request fields that do not change between calls are built once;
+        # the request methods only add the date/step/param specific ones
+        
+        # MARS request template for IFS operational data
+        self._ifs_request = {
+            "class": "od",                   # Operational data
+            "expver": "1",                   # Latest operational version
+            "stream": "oper",                # Operational stream
+            "type": "fc",                    # Forecast type
+            "levtype": "sfc",               # Surface level type
+            "param": (                       # Multiple parameters in single request
+                "167.128/168.128/165.128/166.128/228.128/"  # Basic met variables
+                "228246/228247/39/40/41/42/43/172/26/129"    # Wind, soil, masks
+            ),
+            "time": "00:00:00",             # 00 UTC base time
+            "step": "/".join(map(str, range(0, 49))),  # All forecast hours 0-48
+            "grid": "0.1/0.1",              # 0.1° resolution (~10km)
+            "area": self.area_bbox,          # Geographic bounds
+        }
+        
+        # Polytope request templates for Extremes-DT data, by level type
+        polytope_request = {
+            "class": "d1",                    # Destination Earth class 1
+            "expver": "0001",                 # Experiment version
+            "stream": "oper",                 # Operational stream
+            "dataset": "extremes-dt",         # Extremes Digital Twin dataset
+            "time": "0000",                   # 00 UTC base time
+            "type": "fc",                     # Forecast type
+            "area": self.area_bbox,           # Geographic bounds
+            "grid": "0.04/0.04",             # ~4km resolution grid
+        }
+        self._polytope_requests = {
+            # Surface level
+            "sfc": {**polytope_request, "levtype": "sfc", "levelist": ""},
+            # 100m height level
+            "hl": {**polytope_request, "levtype": "hl", "levelist": "100"},
+        }
+    
+    def _get_polytope_client(self):
+        """
+        Return the Polytope client of the current thread.
+        
+        The client (configuration and credentials from ~/.polytopeapirc)
+        is created on the first request and reused afterwards.
+        
+        Returns:
+            polytope.api.Client: Client connected to the Polytope address
+        """
+        client = getattr(self._clients, "polytope", None)
+        if client is None:
+            from polytope.api import Client
+            client = Client(address=self.polytope_address)
+            self._clients.polytope = client
+        return client
+    
+    def _get_mars_client(self):
+        """
+        Return the MARS client of the current thread.
+        
+        The client (credentials from ~/.ecmwfapirc) is created on the
+        first request and reused afterwards.
+        
+        Returns:
+            ecmwfapi.ECMWFService: MARS web API service
+        """
+        client = getattr(self._clients, "mars", None)
+        if client is None:
+            from ecmwfapi import ECMWFService
+            client = ECMWFService("mars")
+            self._clients.mars = client
+        return client
     
     def perform_politope_request(
         self, 
@@ -57,26 +173,29 @@ class c_api_request:
         Returns:
             bool: True if download successful, False otherwise
         """
+        # Download to a temporary file, renamed only once complete
+        part_path = f"{output_file_path}.part"
         try:
-            # Connect to Polytope service and submit request
-            data = ek.from_source(
-                "polytope", 
-                "ecmwf-destination-earth",
-                request_dict,
-                address=self.polytope_address,
-                stream=False
-            )
+            # Reuse the Polytope client of this thread
+            client = self._get_polytope_client()
             
-            print(f"[{datetime.datetime.now()}] Downloading {output_file_path}...")
+            logger.info("Downloading %s...", output_file_path)
             
-            # Save data to specified file
-            data.to_target("file", output_file_path)
+            # Submit request and save data to specified file
+            with self._polytope_slots:
+                client.retrieve(
+                    self.polytope_collection,
+                    request_dict,
+                    part_path,
+                )
+            commit_file(part_path, output_file_path)
             
-            print(f"[{datetime.datetime.now()}] Saved {output_file_path}")
+            logger.info("Saved %s", output_file_path)
             return True
             
         except Exception as e:
-            print(f"[{datetime.datetime.now()}] Polytope request failed: {e}")
+            logger.error("Polytope request failed: %s", e)
+            remove_partial_file(part_path)
             return False         
         
 
@@ -100,29 +219,42 @@ class c_api_request:
             dict: Complete Polytope request dictionary
         """
         # Wind parameters at 100m height require special level configuration
-        wind_100m_params = ["131", "132", "228246", "228247"]
-        is_wind_100m = param in wind_100m_params
+        levtype = "hl" if param in WIND_100M_PARAMS else "sfc"
+        
+        return self.polytope_get_batched_request(date, [param], levtype)
+
+    def polytope_get_batched_request(
+        self, 
+        date: str, 
+        params: List[str], 
+        levtype: str
+    ) -> Dict[str, Any]:
+        """
+        Create a single Polytope request for several Extremes-DT parameters.
         
+        Parameters sharing the same level type and step configuration can
+        be retrieved in one round-trip. Precipitation ('228') uses
+        accumulation steps and must therefore be requested on its own.
+        
+        Args:
+            date: Date in YYYYMMDD format
+            params: ECMWF parameter codes (e.g., ['167', '168'])
+            levtype: Level type of all the parameters ('sfc' or 'hl')
+            
+        Returns:
+            dict: Complete Polytope request dictionary
+        """
         # Precipitation requires different step configuration (accumulation periods)
         step_config = (
-            "0-1/to/48/by/1" if param == "228" 
+            "0-1/to/48/by/1" if "228" in params 
             else "0/to/48/by/1"
         )
         
         return {
-            "class": "d1",                    # Destination Earth class 1
-            "expver": "0001",                 # Experiment version
-            "stream": "oper",                 # Operational stream
-            "dataset": "extremes-dt",         # Extremes Digital Twin dataset
+            **self._polytope_requests[levtype],
             "date": date,                     # Forecast base date
-            "time": "0000",                   # 00 UTC base time
-            "type": "fc",                     # Forecast type
-            "levtype": "hl" if is_wind_100m else "sfc",  # Height/Surface level
-            "levelist": "100" if is_wind_100m else "",   # 100m height
             "step": step_config,              # Forecast steps (hours)
-            "param": param,                   # Meteorological parameter
-            "area": self.area_bbox,           # Geographic bounds
-            "grid": "0.04/0.04",             # ~4km resolution grid
+            "param": "/".join(params),        # Meteorological parameters
         }
 
     def perform_mars_request(
@@ -143,22 +275,26 @@ class c_api_request:
         Returns:
             bool: True if download successful, False otherwise
         """
-        print(f"[{datetime.datetime.now()}] Set request...")
+        logger.info("Set request...")
         
+        # Download to a temporary file, renamed only once complete
+        part_path = f"{output_file_path}.part"
         try:
-            # Connect to MARS service and submit request
-            data = ek.from_source("mars", request_dict)
+            # Reuse the MARS client of this thread
+            client = self._get_mars_client()
             
-            print(f"[{datetime.datetime.now()}] Downloading {output_file_path}...")
+            logger.info("Downloading %s...", output_file_path)
             
-            # Save data to specified file
-            data.to_target("file", output_file_path)
+            # Submit request and save data to specified file
+            client.execute(request_dict, part_path)
+            commit_file(part_path, output_file_path)
             
-            print(f"[{datetime.datetime.now()}] Saved {output_file_path}")
+            logger.info("Saved %s", output_file_path)
             return True
             
         except Exception as e:
-            print(f"[{datetime.datetime.now()}] MARS request failed: {e}")
+            logger.error("MARS request failed: %s", e)
+            remove_partial_file(part_path)
             return False   
               
     def mars_get_ifs(self, date: str) -> Dict[str, Any]:
@@ -191,52 +327,7 @@ class c_api_request:
         Returns:
             dict: Complete MARS request dictionary
         """
-        # Generate forecast steps from 0 to 48 hours
-        forecast_steps = "/".join(str(i) for i in range(0, 49))
-        
         return {
-            "class": "od",                   # Operational data
-            "expver": "1",                   # Latest operational version
-            "stream": "oper",                # Operational stream
-            "type": "fc",                    # Forecast type
-            "levtype": "sfc",               # Surface level type
-            "param": (                       # Multiple parameters in single request
-                "167.128/168.128/165.128/166.128/228.128/"  # Basic met variables
-                "228246/228247/39/40/41/42/43/172/26/129"    # Wind, soil, masks
-            ),
+            **self._ifs_request,
             "date": date,                    # Forecast base date
-            "time": "00:00:00",             # 00 UTC base time
-            "step": forecast_steps,          # All forecast hours 0-48
-            "grid": "0.1/0.1",              # 0.1° resolution (~10km)
-            "area": self.area_bbox,          # Geographic bounds
-        }     
-
-    # Legacy method - kept for reference
-    # def mars_get_instant_variables_request(self, date: str) -> Dict[str, Any]:
-    #     """
-    #     Legacy MARS request method for research data (commented out).
-    #     
-    #     This method was used for accessing research data with higher resolution
-    #     but is no longer actively used in favor of the operational IFS data.
-    #     
-    #     Args:
-    #         date: Forecast base date
-    #         
-    #     Returns:
-    #         dict: MARS request dictionary for research data
-    #     """
-    #     return {
-    #         "class": "rd",                   # Research data
-    #         "expver": "iekm",               # Experiment version
-    #         "stream": "oper",               # Operational stream
-    #         "type": "fc",                   # Forecast type
-    #         "levtype": "sfc",              # Surface level
-    #         "param": "167/168/165/166/228/228246/228247",  # Met parameters
-    #         "date": date,                   # Base date
-    #         "time": "0000",                # Base time
-    #         "step": "/".join(str(i) for i in range(1, 49)),  # Steps 1-48
-    #         "grid": "0.04/0.04",           # 4km resolution
-    #         "area": "70.5/-23.5/29.5/62.5",  # Europe region
-    #         "format": "grib2",             # GRIB2 format
-    #     }    
-    
+        }
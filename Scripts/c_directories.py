@@ -12,6 +12,7 @@ Provides organized directory structure for:
 - Script locations
 """
 
+from functools import lru_cache
 from pathlib import Path
 
 class c_directories:
@@ -133,4 +134,37 @@ class c_directories:
         Returns:
             Path: Complete path to final daily GRIB file
         """
-        return self.data_path / f"{self.nwp}_{date}.grib"  
\ No newline at end of file
+        return self.data_path / f"{self.nwp}_{date}.grib"
+
+    def get_missing_params_path(self, date: str) -> Path:
+        """
+        Generate path for the list of parameters missing from a daily file.
+        
+        Written next to the final GRIB file when some parameters could not
+        be downloaded, one ECMWF parameter code per line.
+        
+        Args:
+            date: Date in YYYYMMDD format
+            
+        Returns:
+            Path: Complete path to the missing parameters file
+        """
+        return self.data_path / f"{self.nwp}_{date}.missing"
+
+
+@lru_cache(maxsize=None)
+def get_directories(nwp: str, run_where: str) -> c_directories:
+    """
+    Return the shared directory structure for an NWP model and environment.
+    
+    Instances are cached by (nwp, run_where), so repeated lookups across
+    modules reuse the same object instead of rebuilding every path.
+    
+    Args:
+        nwp: NWP model type ('ifs' for ECMWF IFS, 'edt' for Extremes-DT)
+        run_where: Computing environment ('local' or 'leonardo')
+        
+    Returns:
+        c_directories: Cached directory structure
+    """
+    return c_directories(nwp, run_where)
@@ -1,105 +1,565 @@
+import itertools
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import zarr
 import numpy as np
-import pygrib
-from numcodecs import Blosc
+import eccodes as ecc
+from numcodecs import BitRound, Blosc, blosc
 
 
 # ============================================================
 #  COMPRESSORE
 # ============================================================
 
-# Zstd + Blosc: ottimo per GRIB meteorologici
-compressor = Blosc(cname="zstd", clevel=5, shuffle=Blosc.SHUFFLE)
+# Zstd + Blosc: ottimo per GRIB meteorologici.
+# Lo shuffle riordina i byte (o i bit) dei float32 prima di Zstd: il bit
+# shuffle di solito comprime meglio i campi geofisici, soprattutto dopo
+# BitRound, che lascia a zero i bit meno significativi.
+SHUFFLE_MODES = {
+    "none": Blosc.NOSHUFFLE,
+    "byte": Blosc.SHUFFLE,
+    "bit":  Blosc.BITSHUFFLE,
+}
+
+
+def get_compressor(shuffle="bit", clevel=5):
+    """
+    Restituisce il compressore Blosc/Zstd con lo shuffle richiesto
+    ('none', 'byte' o 'bit').
+    """
+    return Blosc(cname="zstd", clevel=clevel, shuffle=SHUFFLE_MODES[shuffle])
+
+
+# ============================================================
+#  QUANTIZZAZIONE
+# ============================================================
+
+# Bit di mantissa float32 conservati per campo (BitRound, lossy).
+# I bit meno significativi vengono azzerati prima di Zstd, che li
+# comprime quasi a costo zero; 12 bit ~ 3-4 cifre significative.
+# Le chiavi sono gli shortName GRIB; i campi non elencati vengono
+# salvati senza perdita.
+KEEPBITS = {
+    "2t":   12,
+    "2d":   12,
+    "2r":   10,
+    "10u":  12,
+    "10v":  12,
+    "100u": 12,
+    "100v": 12,
+    "u":    12,  # EDT dal 2025-02-05: vento a 100 m (levtype hl)
+    "v":    12,
+    "tp":   10,
+    "lsm":  8,
+    "slt":  8,
+}
+
+
+def get_filters(field):
+    """
+    Restituisce i filtri Zarr di un campo (BitRound se previsto).
+    """
+    keepbits = KEEPBITS.get(field)
+    if keepbits is None:
+        return None
+    return [BitRound(keepbits=keepbits)]
+
+
+# ============================================================
+#  PARALLELISMO
+# ============================================================
+
+# Memoria massima (byte) per i buffer di tutti i processi di scrittura.
+# Ogni processo tiene il blocco di un modello (len(fields) x chunk_time x
+# len(timesteps) x ny x nx float32) più le copie di BitRound e della
+# compressione: per EXTREMES-DT a 0.04° circa 3 GB per data
+MAX_BUFFER_MEMORY = 16 * 2**30
+
+
+def available_cpus():
+    """
+    Restituisce il numero di core utilizzabili dal processo, rispettando
+    l'affinità impostata da SLURM o dai cgroup.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
 
 
 # ============================================================
 #  FUNCTIONS
 # ============================================================
 
-def load_field_from_grib(model, date, timestep, field):
+def get_grib_path(model, date):
+    """
+    Restituisce il percorso del GRIB giornaliero di un modello.
+    Adatta il percorso alle tue convenzioni.
+    """
+    return f"/path/{model}/{date:%Y%m%d}.grib"
+
+
+def stage_grib(grib_path, stage_dir):
     """
-    Carica da GRIB il campo richiesto per un dato lead time (timestep).
-    Adatta il filtro del messaggio GRIB alle tue convenzioni.
+    Copia il GRIB nella scratch locale del nodo (stage_dir) e
+    restituisce il percorso della copia, da cancellare dopo la lettura.
+    Senza stage_dir (default) il GRIB viene letto direttamente dal
+    filesystem condiviso.
     """
-    grib_path = f"/path/{model}/{date:%Y%m%d}.grib"
-    with pygrib.open(grib_path) as grbs:
-        # Cambia 'stepRange' secondo la struttura dei tuoi GRIB
-        msg = grbs.select(shortName=field, stepRange=str(timestep))[0]
-        return msg.values.astype("float32")
+    if not stage_dir:
+        return grib_path
+
+    fd, local_path = tempfile.mkstemp(suffix=".grib", dir=stage_dir)
+    os.close(fd)
+    shutil.copyfile(grib_path, local_path)
+    return local_path
+
+
+def prefetch_grib(grib_path):
+    """
+    Chiede al kernel di iniziare a leggere il GRIB in background
+    (POSIX_FADV_WILLNEED), mentre il file corrente viene elaborato.
+    È solo un suggerimento: gli errori vengono ignorati.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(grib_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def iter_grib_messages(grib_path):
+    """
+    Scorre i messaggi di un GRIB con ecCodes, in un'unica lettura
+    sequenziale. Ogni handle viene rilasciato dopo l'uso.
+    """
+    with open(grib_path, "rb") as f:
+        while True:
+            gid = ecc.codes_grib_new_from_file(f)
+            if gid is None:
+                break
+            try:
+                yield gid
+            finally:
+                ecc.codes_release(gid)
+
+
+# Griglie regolari: i valori sono una matrice (Nj, Ni)
+REGULAR_GRID_TYPES = ("regular_ll", "rotated_ll", "regular_gg")
+
+
+def get_native_grid(model, sample_date, sample_timestep, sample_field):
+    """
+    Restituisce (lats, lons), gli assi 1D della griglia nativa del modello,
+    senza decodificare i valori. Per le griglie lat/lon gli assi vengono
+    ricostruiti con linspace dal primo e ultimo punto; per le gaussiane
+    si usano le latitudini/longitudini distinte di ecCodes.
+    """
+    grib_path = get_grib_path(model, sample_date)
+    for gid in iter_grib_messages(grib_path):
+        if (ecc.codes_get(gid, "shortName") != sample_field
+                or ecc.codes_get(gid, "stepRange") != str(sample_timestep)):
+            continue
+
+        grid_type = ecc.codes_get(gid, "gridType")
+        if grid_type not in REGULAR_GRID_TYPES:
+            raise ValueError(f"Griglia {grid_type} non supportata in {grib_path}")
 
+        ny, nx = ecc.codes_get_long(gid, "Nj"), ecc.codes_get_long(gid, "Ni")
+        if grid_type == "regular_gg":
+            lats = ecc.codes_get_array(gid, "distinctLatitudes")
+            lons = ecc.codes_get_array(gid, "distinctLongitudes")
+        else:
+            # Per rotated_ll sono le coordinate ruotate
+            lats = np.linspace(
+                ecc.codes_get_double(gid, "latitudeOfFirstGridPointInDegrees"),
+                ecc.codes_get_double(gid, "latitudeOfLastGridPointInDegrees"),
+                ny,
+            )
+            lon0 = ecc.codes_get_double(gid, "longitudeOfFirstGridPointInDegrees")
+            lon1 = ecc.codes_get_double(gid, "longitudeOfLastGridPointInDegrees")
+            # GRIB2 codifica le longitudini in [0, 360): un'area che attraversa
+            # Greenwich (es. 336.5 -> 62.5) va riportata a un asse crescente
+            if ecc.codes_get_long(gid, "iScansNegatively") == 0 and lon1 < lon0:
+                lon0 -= 360
+            lons = np.linspace(lon0, lon1, nx)
+        return lats.astype("float32"), lons.astype("float32")
 
-def get_native_shape(model, sample_date, sample_timestep, sample_field):
+    raise ValueError(
+        f"{sample_field} allo step {sample_timestep} non trovato in {grib_path}"
+    )
+
+
+def get_build_args(
+    dates, timesteps, models, fields, chunk_time, chunk_step, chunk_lat, chunk_lon,
+):
     """
-    Restituisce (ny, nx) della griglia nativa del modello.
+    Argomenti che determinano la struttura dello store, in forma JSON
+    (salvati in root.attrs["build_args"] per verificare una ripresa).
     """
-    grib_path = f"/path/{model}/{sample_date:%Y%m%d}.grib"
-    with pygrib.open(grib_path) as grbs:
-        msg = grbs.select(shortName=sample_field, stepRange=str(sample_timestep))[0]
-        arr = msg.values
-        return arr.shape  # (ny, nx)
+    return {
+        "dates": [f"{date:%Y%m%d}" for date in dates],
+        "timesteps": [int(ts) for ts in timesteps],
+        "models": list(models),
+        "fields": list(fields),
+        "chunk_time": chunk_time,
+        "chunk_step": len(timesteps) if chunk_step is None else chunk_step,
+        "chunk_lat": chunk_lat,
+        "chunk_lon": chunk_lon,
+    }
 
 
-def initialize_zarr(root_path, dates, timesteps, models, fields):
+def initialize_zarr(
+    root_path, dates, timesteps, models, fields,
+    chunk_time=1, chunk_step=None, shuffle="bit", chunk_lat=None, chunk_lon=None,
+):
     """
     Crea la struttura Zarr.
     Un gruppo per modello, ciascuno con griglia nativa diversa.
+    Un array per campo, così ogni campo ha la propria quantizzazione.
+    Ogni chunk contiene chunk_time date consecutive, chunk_step timesteps
+    (di default tutti) e chunk_lat x chunk_lon punti di griglia (di
+    default l'intero dominio). Un chunk non può superare il limite di
+    Blosc (blosc.MAX_BUFFERSIZE, circa 2 GB).
     """
+    if chunk_step is None:
+        chunk_step = len(timesteps)
+    compressor = get_compressor(shuffle)
+
+    # Griglie e chunk di ogni modello, verificati prima di toccare lo store
+    grids = {}
+    for model in models:
+        lats, lons = get_native_grid(model, dates[0], timesteps[0], fields[0])
+        chunks = (
+            chunk_time,
+            chunk_step,
+            min(chunk_lat or lats.size, lats.size),
+            min(chunk_lon or lons.size, lons.size),
+        )
+        chunk_bytes = 4 * int(np.prod(chunks))  # float32
+        if chunk_bytes > blosc.MAX_BUFFERSIZE:
+            raise ValueError(
+                f"Chunk {chunks} di {model} da {chunk_bytes} byte oltre il limite "
+                f"di Blosc ({blosc.MAX_BUFFERSIZE}): riduci chunk_time, "
+                f"chunk_step, chunk_lat o chunk_lon"
+            )
+        grids[model] = lats, lons, chunks
+
     root = zarr.open(root_path, mode="w")
+    root.attrs["build_args"] = get_build_args(
+        dates, timesteps, models, fields, chunk_time, chunk_step, chunk_lat, chunk_lon
+    )
 
     # Coordinate comuni
-    root.create_dataset("date",     data=np.array([d.isoformat() for d in dates], dtype=object))
-    root.create_dataset("field",    data=np.array(fields, dtype=object))
+    # Date come datetime64 e nomi come stringhe a lunghezza fissa:
+    # gli array object richiederebbero un object_codec in Zarr
+    root.create_dataset("date",     data=np.array(dates, dtype="datetime64[ns]"))
+    root.create_dataset("field",    data=np.array(fields, dtype=str))
     root.create_dataset("timestep", data=np.array(timesteps, dtype="int32"))
-    root.create_dataset("model",    data=np.array(models, dtype=object))
+    root.create_dataset("model",    data=np.array(models, dtype=str))
 
     # Gruppi per ogni modello
     for model in models:
-        ny, nx = get_native_shape(model, dates[0], timesteps[0], fields[0])
+        lats, lons, chunks = grids[model]
+        ny, nx = lats.size, lons.size
         grp = root.create_group(model)
+        grp.create_dataset("latitude",  data=lats)
+        grp.create_dataset("longitude", data=lons)
 
-        grp.create(
-            "data",
-            shape=(len(dates), len(timesteps), len(fields), ny, nx),
-            chunks=(1, 1, 1, ny, nx),
-            dtype="float32",
-            compressor=compressor,
-        )
+        for field in fields:
+            grp.create(
+                field,
+                shape=(len(dates), len(timesteps), ny, nx),
+                chunks=chunks,
+                dtype="float32",
+                fill_value=np.nan,
+                filters=get_filters(field),
+                compressor=compressor,
+            )
 
     return root
 
 
-def write_one_date(root, idt, date, timesteps, models, fields):
+def write_dates(
+    root_path, i0, dates, timesteps, models, fields, stage_dir=None, n_threads=1,
+):
     """
-    Scrive tutti i timesteps e campi di una data per ogni modello.
+    Scrive tutti i timesteps e campi di un blocco di date consecutive
+    (a partire dall'indice i0) per ogni modello.
+    Il blocco coincide con un chunk lungo il tempo: i dati vengono
+    accumulati in memoria e scritti con un'unica scrittura allineata,
+    senza rileggere e ricomprimere i chunk.
+    Riapre lo store Zarr, quindi può girare in un processo separato.
+    Con stage_dir ogni GRIB viene letto da una copia locale, evitando
+    le molte operazioni sui metadati del filesystem condiviso (Lustre).
+    n_threads è il numero di core assegnati al processo, usati per
+    comprimere e scrivere i chunk in parallelo.
+    Restituisce le date (YYYYMMDD) con almeno un GRIB mancante.
     """
-    for model in models:
-        arr = root[model]["data"]
+    # Posizione (timestep, campo) di ogni messaggio GRIB da scrivere.
+    # Cambia 'stepRange' secondo la struttura dei tuoi GRIB
+    slots = {
+        (field, str(ts)): (field, its)
+        for its, ts in enumerate(timesteps)
+        for field in fields
+    }
+
+    date_keys = [f"{date:%Y%m%d}" for date in dates]
+    missing = set()
+    for im, model in enumerate(models):
+        # Primo GRIB del modello successivo, letto in anticipo mentre si
+        # elabora l'ultimo GRIB di questo (con chunk_time=1 è l'unico)
+        next_path = (
+            get_grib_path(models[im + 1], dates[0]) if im + 1 < len(models) else None
+        )
+        # I buffer di un modello vengono liberati al ritorno, prima di
+        # allocare quelli del modello successivo
+        missing |= write_model_dates(
+            root_path, i0, model, dates, date_keys, fields, slots, stage_dir,
+            n_threads, next_path,
+        )
+
+    return missing
+
+
+def write_model_dates(
+    root_path, i0, model, dates, date_keys, fields, slots, stage_dir, n_threads,
+    next_path=None,
+):
+    """
+    Legge i GRIB di un modello per un blocco di date e scrive ogni campo
+    con un'unica scrittura allineata (vedi write_dates).
+    next_path è il GRIB da leggere in anticipo dopo l'ultimo del blocco.
+    Restituisce le date (YYYYMMDD) il cui GRIB è mancante.
+    """
+    missing = set()
+
+    # Array del modello aperti una sola volta (ogni accesso al gruppo
+    # rilegge i metadati dallo store). I chunk tutti NaN (date senza
+    # GRIB) non vengono scritti: write_empty_chunks non è salvato nei
+    # metadati, va indicato a ogni apertura
+    arrays = {
+        field: zarr.open_array(
+            root_path, path=f"{model}/{field}", mode="r+", write_empty_chunks=False
+        )
+        for field in fields
+    }
+    # Buffer del blocco per campo: i messaggi mancanti restano NaN
+    bufs = {
+        field: np.full((len(dates),) + arr.shape[1:], np.nan, dtype="float32")
+        for field, arr in arrays.items()
+    }
+
+    # Percorsi dei GRIB del blocco calcolati una sola volta
+    grib_paths = [get_grib_path(model, date) for date in dates]
+    prefetch_paths = grib_paths[1:] + [next_path]
+
+    for idt, grib_path in enumerate(grib_paths):
+        # Lettura anticipata del GRIB successivo durante l'elaborazione
+        if prefetch_paths[idt] is not None:
+            prefetch_grib(prefetch_paths[idt])
+        # GRIB mancante: la data resta NaN nel buffer
+        if not os.path.exists(grib_path):
+            missing.add(date_keys[idt])
+            continue
+        local_path = stage_grib(grib_path, stage_dir)
+        try:
+            # Una sola lettura sequenziale del GRIB per modello e data
+            for gid in iter_grib_messages(local_path):
+                slot = slots.get(
+                    (ecc.codes_get(gid, "shortName"), ecc.codes_get(gid, "stepRange"))
+                )
+                if slot is None:
+                    continue
+
+                field, its = slot
+                values = ecc.codes_get_values(gid)
+                # Decodifica float64 di ecCodes convertita subito in float32
+                dest = bufs[field][idt, its]
+                dest[...] = values.reshape(dest.shape)
+                # Punti mancanti (bitmap GRIB): ecCodes restituisce missingValue
+                if ecc.codes_get_long(gid, "bitmapPresent"):
+                    is_missing = values == ecc.codes_get_double(gid, "missingValue")
+                    dest[is_missing.reshape(dest.shape)] = np.nan
+        finally:
+            if local_path != grib_path:
+                os.remove(local_path)
+
+    # Ogni chunk del blocco (per campo, timesteps e area) è indipendente:
+    # compressione e scrittura in parallelo su thread (Blosc e lo store
+    # rilasciano il GIL), al più uno per core assegnato al processo
+    regions = [
+        (field, region)
+        for field, arr in arrays.items()
+        for region in itertools.product(*(
+            [slice(j, j + c) for j in range(0, n, c)]
+            for n, c in zip(arr.shape[1:], arr.chunks[1:])
+        ))
+    ]
 
-        for its, ts in enumerate(timesteps):
-            for ifl, field in enumerate(fields):
+    def write_region(task):
+        field, region = task
+        arrays[field][(slice(i0, i0 + len(dates)),) + region] = bufs[field][
+            (slice(None),) + region
+        ]
 
-                data = load_field_from_grib(model, date, ts, field)
-                arr[idt, its, ifl, :, :] = data
+    with ThreadPoolExecutor(max_workers=min(len(regions), n_threads)) as executor:
+        list(executor.map(write_region, regions))
+
+    return missing
 
 
 # ============================================================
 #  MAIN EXECUTION
 # ============================================================
 
-def build_dataset(root_path, dates, timesteps, models, fields):
-    root = initialize_zarr(root_path, dates, timesteps, models, fields)
+def build_dataset(
+    root_path, dates, timesteps, models, fields,
+    chunk_time=1, chunk_step=None, shuffle="bit", stage_dir=None, force=False,
+    zip_path=None, max_workers=None, chunk_lat=None, chunk_lon=None,
+):
+    """
+    Crea lo store Zarr e scrive tutte le date.
+    Se lo store esiste già, le date completate in un'esecuzione precedente
+    (root.attrs["completed_dates"]) vengono saltate; con force=True lo
+    store viene ricreato da zero. Per riprendere servono gli stessi
+    argomenti dell'esecuzione interrotta (root.attrs["build_args"]),
+    altrimenti viene sollevato un ValueError.
+    La scrittura avviene sempre su uno store a directory, che i processi
+    possono aggiornare in parallelo. Con zip_path, a esecuzione completa
+    (tutte le date scritte) lo store viene convertito in un unico file
+    zip e la directory rimossa (vedi finalize_store); se lo zip esiste
+    già e force=False non c'è nulla da fare.
+    Ogni processo tiene in memoria len(fields) x chunk_time x
+    len(timesteps) x ny x nx float32 per volta: max_workers limita il
+    numero di processi, e quindi la memoria di picco (default: quanti
+    ne stanno in MAX_BUFFER_MEMORY, al più uno per core).
+    """
+    if zip_path and os.path.exists(zip_path) and not force:
+        return
 
-    for idt, date in enumerate(dates):
-        write_one_date(root, idt, date, timesteps, models, fields)
+    if force or not os.path.exists(root_path):
+        initialize_zarr(
+            root_path, dates, timesteps, models, fields,
+            chunk_time, chunk_step, shuffle, chunk_lat, chunk_lon,
+        )
+
+    root = zarr.open(root_path, mode="r")
+    build_args = get_build_args(
+        dates, timesteps, models, fields, chunk_time, chunk_step, chunk_lat, chunk_lon
+    )
+    if root.attrs.get("build_args") != build_args:
+        raise ValueError(
+            f"{root_path} è stato creato con argomenti diversi: "
+            "usa gli stessi dell'esecuzione interrotta o force=True"
+        )
+    completed = set(root.attrs.get("completed_dates", []))
+
+    # Un blocco di date per ogni chunk lungo il tempo: i blocchi scrivono
+    # chunk distinti, sono indipendenti e vengono elaborati in parallelo
+    date_keys = [f"{date:%Y%m%d}" for date in dates]
+    blocks = [
+        (i0, dates[i0:i0 + chunk_time])
+        for i0 in range(0, len(dates), chunk_time)
+        if not completed.issuperset(date_keys[i0:i0 + chunk_time])
+    ]
+    if blocks:
+        write_blocks(
+            root_path, blocks, completed, timesteps, models, fields, stage_dir, max_workers
+        )
+
+    # Lo zip si scrive solo a store completo: le date mancanti restano da
+    # riprendere sullo store a directory
+    complete = completed.issuperset(date_keys)
+    finalize_store(root_path, zip_path if complete else None)
+
+
+def write_blocks(
+    root_path, blocks, completed, timesteps, models, fields, stage_dir, max_workers=None,
+):
+    """
+    Scrive i blocchi di date in parallelo, un processo per blocco (al più
+    max_workers processi), e registra in root.attrs["completed_dates"]
+    ogni blocco terminato.
+    """
+    root = zarr.open(root_path, mode="r+")
+    n_cpus = available_cpus()
+    if max_workers is None:
+        # Due copie del blocco più grande per processo (buffer e codifica)
+        block_bytes = max(
+            sum(root[model][field].nbytes // root[model][field].shape[0] for field in fields)
+            for model in models
+        ) * len(blocks[0][1])
+        max_workers = max(1, MAX_BUFFER_MEMORY // (2 * block_bytes))
+    max_workers = min(len(blocks), max_workers, n_cpus)
+    # Core di ciascun processo, usati dai thread di scrittura
+    n_threads = max(1, n_cpus // max_workers)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                write_dates,
+                root_path, i0, block, timesteps, models, fields, stage_dir, n_threads,
+            ): [f"{date:%Y%m%d}" for date in block]
+            for i0, block in blocks
+        }
+        for future in as_completed(futures):
+            missing = future.result()
+
+            # Solo il processo principale aggiorna gli attributi dello store.
+            # Le date con GRIB mancanti restano da completare
+            completed.update(set(futures[future]) - missing)
+            root.attrs["completed_dates"] = sorted(completed)
+
+
+def finalize_store(root_path, zip_path=None):
+    """
+    Consolida i metadati dello store in un unico .zmetadata, così i
+    lettori lo aprono con zarr.open_consolidated in una sola lettura.
+    Con zip_path lo store viene copiato in un unico file ZipStore, per non
+    lasciare un file per chunk sul filesystem condiviso, e la directory
+    viene rimossa. Lo zip è scritto in zip_path + ".part" e rinominato
+    solo a copia terminata.
+    """
+    zarr.consolidate_metadata(root_path)
+
+    if zip_path:
+        part_path = f"{zip_path}.part"
+        with zarr.ZipStore(part_path, mode="w") as zip_store:
+            zarr.copy_store(zarr.DirectoryStore(root_path), zip_store)
+        os.replace(part_path, zip_path)
+        shutil.rmtree(root_path)
 
 
 # ============================================================
 #  USO
 # ============================================================
 
-dates     = [...]               # lista datetime
-timesteps = list(range(1, 49))  # 1h–48h
-models    = ["IFS", "EXTREMES-DT", "ICONEU"]
-fields    = ["t2m", "u10", "v10","td2m","rh2m","u100","v100"]
+if __name__ == "__main__":
+    start, end = np.datetime64("2025-01-01"), np.datetime64("2025-01-31")
+    dates     = np.arange(start, end + np.timedelta64(1, "D")).astype(object)  # lista datetime.date
+    timesteps = list(range(1, 49))  # 1h–48h
+    models    = ["IFS", "EXTREMES-DT", "ICONEU"]
+    fields    = ["2t", "10u", "10v", "2d", "2r", "100u", "100v"]  # shortName GRIB
+
+    # Copia dei GRIB nella scratch locale del nodo prima della lettura:
+    # disattivata di default, indicare un percorso locale del nodo (su
+    # Leonardo: NVMe per nodo), non una directory sul filesystem condiviso
+    stage_dir = None
+
+    # Processi di scrittura: None li stima da MAX_BUFFER_MEMORY; su SLURM
+    # si può fissare in base alla memoria richiesta dal job
+    max_workers = None
 
-build_dataset("dataset.zarr", dates, timesteps, models, fields)
+    build_dataset(
+        "dataset.zarr", dates, timesteps, models, fields,
+        stage_dir=stage_dir, max_workers=max_workers,
+    )